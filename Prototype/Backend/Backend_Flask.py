@@ -7,11 +7,20 @@ and employs JWT for secure access. It also integrates logging for monitoring and
 @version 1.0
 """
 
+import os
+
+# Size the OpenMP/BLAS thread pools before numpy, torch or FAISS are imported (they read these variables
+# only once, at import), so Gunicorn workers and the Ollama server do not oversubscribe the CPU.
+# FAISS_THREADS overrides the default of half the CPU count; RAG.py applies the same value to FAISS.
+_thread_count = os.environ.setdefault("FAISS_THREADS", str(max(1, (os.cpu_count() or 1) // 2)))
+os.environ.setdefault("OMP_NUM_THREADS", _thread_count)
+os.environ.setdefault("MKL_NUM_THREADS", _thread_count)
+os.environ.setdefault("OPENBLAS_NUM_THREADS", _thread_count)
+
 import base64
 from flask import Flask, request, Response, jsonify
 from flask_cors import CORS
 import requests
-import os
 import json
 from werkzeug.utils import secure_filename
 import PyPDF2
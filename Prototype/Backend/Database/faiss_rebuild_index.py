@@ -0,0 +1,119 @@
+"""
+@fileoverview
+This script rebuilds the LangChain FAISS vector stores used by the RAG module with an approximate index.
+It reads the stored vectors back out of the existing flat index, builds an IndexHNSWFlat (default) or
+an IndexIVFPQ from them, and saves the store again with the same docstore and ID mapping, so the RAG
+module loads it without any changes.
+
+Usage:
+    python Prototype/Backend/Database/faiss_rebuild_index.py [--index-type hnsw|ivfpq]
+
+Stores that are too small to train the IVF+PQ inverted lists and product quantizer are left untouched.
+
+@version 1.0
+"""
+
+import math
+import argparse
+import faiss
+from langchain_community.embeddings import SentenceTransformerEmbeddings
+from langchain_community.vectorstores import FAISS
+
+# Vector stores to rebuild (relative to the repository root, as in RAG.py)
+VECTOR_STORE_PATHS = [
+    "Prototype/Backend/Database/HR/Vector/Full_HR",
+    "Prototype/Backend/Database/HR/Vector/QA_HR",
+]
+
+PQ_SUBQUANTIZERS = 16  # Number of PQ sub-vectors (must divide the embedding dimension)
+PQ_BITS = 8  # Bits per PQ code, i.e. 256 centroids per sub-quantizer
+MIN_POINTS_PER_LIST = 39  # FAISS warns when k-means gets fewer training points per centroid
+DEFAULT_NPROBE = 8  # Inverted lists visited per query; RAG.py sets the same value at load time
+HNSW_M = 32  # Neighbours per node in the HNSW graph
+HNSW_EF_CONSTRUCTION = 200  # Candidate list size while building the graph
+HNSW_EF_SEARCH = 64  # Candidate list size per query; RAG.py sets the same value at load time
+
+
+def build_hnsw_index(vectors):
+    """
+    Builds an IndexHNSWFlat graph over the given vectors in their original order.
+
+    Args:
+        vectors (numpy.ndarray): Float32 matrix of shape (N, d) read from the flat index.
+
+    Returns:
+        faiss.Index: The HNSW index (L2 metric, matching the flat index it replaces).
+    """
+    index = faiss.IndexHNSWFlat(vectors.shape[1], HNSW_M)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    # Sequential IDs keep index positions aligned with the store's index_to_docstore_id mapping
+    index.add(vectors)
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def build_ivfpq_index(vectors):
+    """
+    Trains an IndexIVFPQ on the given vectors and adds them in their original order.
+
+    Args:
+        vectors (numpy.ndarray): Float32 matrix of shape (N, d) read from the flat index.
+
+    Returns:
+        faiss.Index or None: The trained IVF+PQ index, or None if there are too few vectors to train it.
+    """
+    n, d = vectors.shape
+    nlist = max(1, int(math.sqrt(n)))
+    min_points = max(2 ** PQ_BITS, MIN_POINTS_PER_LIST * nlist)
+    if n < min_points:
+        print(f"Only {n} vectors, need at least {min_points} to train IVF{nlist},PQ{PQ_SUBQUANTIZERS}. Keeping the flat index.")
+        return None
+
+    index = faiss.index_factory(d, f"IVF{nlist},PQ{PQ_SUBQUANTIZERS}x{PQ_BITS}")
+    index.train(vectors)
+    # Sequential IDs keep index positions aligned with the store's index_to_docstore_id mapping
+    index.add(vectors)
+    index.nprobe = DEFAULT_NPROBE
+    return index
+
+
+def rebuild_vector_store(path, embedding_function, index_type):
+    """
+    Replaces the flat index of a saved LangChain FAISS store with an HNSW or IVF+PQ index.
+
+    Args:
+        path (str): Directory containing index.faiss and index.pkl.
+        embedding_function: Embeddings used when the store was built.
+        index_type (str): Either 'hnsw' or 'ivfpq'.
+
+    Returns:
+        None
+    """
+    store = FAISS.load_local(path, embedding_function, allow_dangerous_deserialization=True)
+    if not isinstance(store.index, faiss.IndexFlat):
+        print(f"{path} is not a flat index. Skipping.")
+        return
+    vectors = store.index.reconstruct_n(0, store.index.ntotal)
+    print(f"Loaded {store.index.ntotal} vectors of dimension {store.index.d} from {path}.")
+
+    if index_type == "hnsw":
+        index = build_hnsw_index(vectors)
+    else:
+        index = build_ivfpq_index(vectors)
+    if index is None:
+        return
+
+    store.index = index
+    store.save_local(path)
+    print(f"Saved {index_type} index to {path}.")
+
+
+# Rebuild every vector store once when the script is executed directly
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the HR FAISS vector stores with an approximate index.")
+    parser.add_argument("--index-type", choices=["hnsw", "ivfpq"], default="hnsw", help="Index to build (default: hnsw).")
+    args = parser.parse_args()
+
+    embedding_function = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
+    for path in VECTOR_STORE_PATHS:
+        rebuild_vector_store(path, embedding_function, args.index_type)
@@ -0,0 +1,101 @@
+"""
+@fileoverview
+This script exports the all-MiniLM-L6-v2 query encoder used by the RAG module to ONNX and applies dynamic
+INT8 quantization with optimum. The RAG module uses the quantized encoder only when model_quantized.onnx
+exists in the output directory, and falls back to the PyTorch SentenceTransformer encoder otherwise.
+
+The quantization config is chosen for the CPU the script runs on, so run it on the serving machine
+(or one with the same instruction set).
+
+Usage:
+    python Prototype/Backend/Database/onnx_quantize_encoder.py
+
+@version 1.0
+"""
+
+import os
+import shutil
+import tempfile
+from transformers import AutoTokenizer
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+# Model to export and the directory the RAG module loads it from (relative to the repository root, as in RAG.py)
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+MODEL_DIR = "Prototype/Backend/Database/Models/all-MiniLM-L6-v2-onnx-int8"
+
+
+def cpu_flags():
+    """
+    Reads the instruction set flags of the current CPU.
+
+    Returns:
+        set: The CPU flags listed in /proc/cpuinfo, or an empty set where that file is unavailable.
+    """
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def select_quantization_config():
+    """
+    Picks the dynamic INT8 quantization config that matches the current CPU.
+
+    AVX-512 VNNI has native INT8 dot products. Without VNNI, reduce_range keeps the 8-bit multiplications
+    from saturating the 16-bit intermediate results.
+
+    Returns:
+        QuantizationConfig: The optimum quantization config.
+    """
+    flags = cpu_flags()
+    if "avx512_vnni" in flags:
+        print("CPU supports AVX-512 VNNI.")
+        return AutoQuantizationConfig.avx512_vnni(is_static=False)
+    if "avx512f" in flags:
+        print("CPU supports AVX-512 without VNNI.")
+        return AutoQuantizationConfig.avx512(is_static=False, reduce_range=True)
+    print("Using the AVX2 quantization config.")
+    return AutoQuantizationConfig.avx2(is_static=False, reduce_range=True)
+
+
+def export_quantized_encoder(model_name, model_dir):
+    """
+    Exports the model to ONNX, quantizes it, and moves the result into place in one step.
+
+    The files are written to a temporary directory next to model_dir first, so an interrupted export
+    never leaves a partly written model where the RAG module would load it.
+
+    Args:
+        model_name (str): Hugging Face id of the sentence-transformers model.
+        model_dir (str): Directory the quantized model and tokenizer are saved to.
+
+    Returns:
+        None
+    """
+    parent_dir = os.path.dirname(os.path.abspath(model_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".onnx-export-", dir=parent_dir)
+    try:
+        print(f"Exporting {model_name} to ONNX...")
+        model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True, provider="CPUExecutionProvider")
+        quantizer = ORTQuantizer.from_pretrained(model)
+        quantizer.quantize(save_dir=tmp_dir, quantization_config=select_quantization_config())
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp_dir)
+
+        if os.path.isdir(model_dir):
+            shutil.rmtree(model_dir)
+        os.replace(tmp_dir, model_dir)
+        print(f"Saved quantized encoder to {model_dir}.")
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+
+
+# Export the quantized encoder once when the script is executed directly
+if __name__ == "__main__":
+    export_quantized_encoder(MODEL_NAME, MODEL_DIR)
@@ -8,40 +8,521 @@ and streams the generated response back to the client.
 @version 1.0
 """
 
+import io
+import os
 import re
-import json
+import pickle
+import time
+import functools
+import hashlib
 import logging
 import warnings
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 import requests
+import numpy as np
+from requests.adapters import HTTPAdapter
 
 # FAISS imports for vector similarity search
+import faiss
+from langchain_core.embeddings import Embeddings
 from langchain_community.embeddings import SentenceTransformerEmbeddings
 from langchain_community.vectorstores import FAISS
 
+# ONNX Runtime imports for the quantized query encoder (optional)
+try:
+    from transformers import AutoTokenizer
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
 # Ranker import for re-ranking search results
 from flashrank import Ranker, RerankRequest
 
+# Limit FAISS's OpenMP pool so Gunicorn workers and the Ollama server sharing this machine do not
+# oversubscribe the CPU. The OMP/MKL/OpenBLAS variables are set by the entry point (Backend_Flask.py).
+FAISS_THREADS = int(os.environ.get("FAISS_THREADS", max(1, (os.cpu_count() or 1) // 2)))
+faiss.omp_set_num_threads(FAISS_THREADS)
+
 # Suppress any warnings to keep the logs clean
 warnings.filterwarnings("ignore")
 
 # Initialize logging with INFO level and a specific format
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Initialize embedding function using SentenceTransformer
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps another embeddings object with an LRU cache in front of query embedding.
+
+    FAISS calls embed_query for every similarity search, so repeated queries skip the encoder forward pass.
+
+    Args:
+        inner (Embeddings): The embeddings object that computes uncached vectors.
+        maxsize (int): Maximum number of query embeddings kept in the cache.
+    """
+
+    def __init__(self, inner, maxsize=2048):
+        self.inner = inner
+        self._embed_query_cached = functools.lru_cache(maxsize=maxsize)(lambda text: tuple(inner.embed_query(text)))
+
+    def embed_documents(self, texts):
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        # Return a fresh list so callers cannot mutate the cached vector
+        return list(self._embed_query_cached(text))
+
+
+class ONNXSentenceEmbeddings(Embeddings):
+    """
+    MiniLM sentence embeddings served by ONNX Runtime with a dynamically INT8-quantized model.
+
+    The quantized model is produced offline by Database/onnx_quantize_encoder.py.
+    Embeddings are mean-pooled and L2-normalized to match the SentenceTransformer vectors stored in FAISS.
+
+    Args:
+        model_dir (str): Directory holding model_quantized.onnx and the tokenizer.
+    """
+
+    def __init__(self, model_dir):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(model_dir, file_name=ONNX_ENCODER_FILE, provider="CPUExecutionProvider")
+
+    def embed_documents(self, texts):
+        inputs = self.tokenizer(list(texts), padding=True, truncation=True, max_length=256, return_tensors="np")
+        token_embeddings = self.model(**inputs).last_hidden_state
+        # Mean-pool over real tokens only, then L2-normalize
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+# Common HR queries embedded at startup so the first requests hit a warm cache
+EMBEDDING_WARMUP_QUERIES = [
+    "leave policy",
+    "how many casual leaves do I get",
+    "medical reimbursement",
+    "travel allowance",
+    "housing policy",
+    "performance review process",
+    "grievance policy",
+    "resignation notice period",
+    "retirement benefits",
+    "insurance policy",
+    "training and development",
+    "code of conduct",
+]
+
+# Quantized ONNX encoder written by Database/onnx_quantize_encoder.py
+ONNX_ENCODER_DIR = "Prototype/Backend/Database/Models/all-MiniLM-L6-v2-onnx-int8"
+ONNX_ENCODER_FILE = "model_quantized.onnx"
+
+# Initialize embedding function, preferring the INT8 ONNX encoder and falling back to SentenceTransformer
 logging.debug("Initializing embedding function...")
-embedding_function = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
+if ONNX_AVAILABLE and os.path.isfile(os.path.join(ONNX_ENCODER_DIR, ONNX_ENCODER_FILE)):
+    embedding_function = CachedEmbeddings(ONNXSentenceEmbeddings(model_dir=ONNX_ENCODER_DIR))
+else:
+    logging.info("Quantized ONNX encoder not available. Using the PyTorch SentenceTransformer encoder.")
+    embedding_function = CachedEmbeddings(SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2"))
+for warmup_query in EMBEDDING_WARMUP_QUERIES:
+    embedding_function.embed_query(warmup_query)
 logging.info("Embedding function initialized.")
 
-# Load FAISS vector stores for full HR dataset and QA HR dataset
-logging.debug("Loading FAISS vector stores...")
-faiss_Full_HR = FAISS.load_local("Prototype/Backend/Database/HR/Vector/Full_HR", embedding_function, allow_dangerous_deserialization=True)
-faiss_QA_HR = FAISS.load_local("Prototype/Backend/Database/HR/Vector/QA_HR", embedding_function, allow_dangerous_deserialization=True)
-logging.info("FAISS vector stores loaded.")
+# Search-time parameters for stores rebuilt by Database/faiss_rebuild_index.py with HNSW or IVF+PQ
+FAISS_NPROBE = 8  # Inverted lists visited per query (IVF)
+FAISS_EF_SEARCH = 64  # Candidate list size per query (HNSW)
+
+# Flag for memory-mapping index files (IO_FLAG_MMAP_IFC maps flat codes too; it must not be OR-ed with
+# IO_FLAG_MMAP, which makes IVF indexes fail to load)
+FAISS_MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+def _load_vector_store(path):
+    """
+    Loads a LangChain FAISS store, memory-mapping the index data instead of copying it into the process.
+
+    With IO_FLAG_MMAP_IFC (recent faiss-cpu releases) the vectors of flat, HNSW and IVF+PQ indexes stay in the
+    page cache and are shared between forked workers. Older FAISS builds fall back to IO_FLAG_MMAP, which
+    only maps IVF inverted lists; flat and HNSW indexes are then read into private memory.
+
+    Args:
+        path (str): Directory containing index.faiss and index.pkl.
+
+    Returns:
+        FAISS: The loaded vector store.
+    """
+    index = faiss.read_index(os.path.join(path, "index.faiss"), FAISS_MMAP_FLAG)
+    if hasattr(index, 'nprobe'):
+        index.nprobe = FAISS_NPROBE
+    if hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = FAISS_EF_SEARCH
+    # Same docstore format that FAISS.save_local writes and FAISS.load_local reads
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embedding_function, index, docstore, index_to_docstore_id)
+
+
+# Lazily loaded FAISS stores and ranker. Each loader takes its lock so concurrent first calls from request
+# threads and retrieval workers load the resource once instead of racing on the same files.
+_faiss_full_hr = None
+_faiss_full_hr_lock = threading.Lock()
+_faiss_qa_hr = None
+_faiss_qa_hr_lock = threading.Lock()
+_ranker = None
+_ranker_lock = threading.Lock()
+
+
+def get_faiss_full_hr():
+    """
+    Returns the full HR vector store, loading it on first use.
+    """
+    global _faiss_full_hr
+    if _faiss_full_hr is None:
+        with _faiss_full_hr_lock:
+            if _faiss_full_hr is None:
+                logging.debug("Loading full HR FAISS vector store...")
+                _faiss_full_hr = _load_vector_store("Prototype/Backend/Database/HR/Vector/Full_HR")
+                logging.info("Full HR FAISS vector store loaded.")
+    return _faiss_full_hr
+
+
+def get_faiss_qa_hr():
+    """
+    Returns the QA HR vector store, loading it on first use.
+    """
+    global _faiss_qa_hr
+    if _faiss_qa_hr is None:
+        with _faiss_qa_hr_lock:
+            if _faiss_qa_hr is None:
+                logging.debug("Loading QA HR FAISS vector store...")
+                _faiss_qa_hr = _load_vector_store("Prototype/Backend/Database/HR/Vector/QA_HR")
+                logging.info("QA HR FAISS vector store loaded.")
+    return _faiss_qa_hr
+
+
+# FlashRank cross-encoder used for re-ranking. FlashRank runs every model on ONNX Runtime; the quantized
+# MiniLM-L-12 cross-encoder is much cheaper per passage than rank-T5-flan, which can still be selected here.
+RERANKER_MODEL = os.environ.get("RERANKER_MODEL", "ms-marco-MiniLM-L-12-v2")
+
+
+def get_ranker():
+    """
+    Returns the ranker for re-ranking search results, initializing it on first use.
+    """
+    global _ranker
+    if _ranker is None:
+        with _ranker_lock:
+            if _ranker is None:
+                logging.debug("Initializing the ranker...")
+                _ranker = Ranker(model_name=RERANKER_MODEL, cache_dir="/Temp")
+                logging.info("Ranker initialized.")
+    return _ranker
+
+
+class TTLCache:
+    """
+    A small thread-safe LRU cache whose entries expire after a fixed time-to-live.
+
+    Args:
+        max_items (int): Maximum number of entries kept before the least recently used one is evicted.
+        ttl_sec (float): Number of seconds an entry stays valid after it was stored.
+    """
+
+    def __init__(self, max_items, ttl_sec):
+        self.max_items = max_items
+        self.ttl_sec = ttl_sec
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached value for the key, or None if it is missing or expired.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """
+        Stores the value under the key, evicting the least recently used entry when the cache is full.
+        """
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl_sec)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+
+def _query_key(user_message):
+    """
+    Builds a cache key from the user message, ignoring case and redundant whitespace.
+    """
+    normalized = ' '.join(user_message.lower().split())
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+
+
+# Pattern for the "Database required: Yes/No" answer of the self-query model, compiled once
+DATABASE_REQUIRED_PATTERN = re.compile(r'Database required:\s*(Yes|No)', re.IGNORECASE)
+
+# Request bodies are serialized with orjson, so the content type has to be set explicitly
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Shared HTTP session so calls to the Ollama API reuse pooled keep-alive connections
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+
+# Cache for the self-query decision, keyed by the normalized user message
+_selfquery_cache = TTLCache(max_items=4096, ttl_sec=300)
+
+# Prompt asking the self-query model whether the database is needed; filled in with the user message
+SELF_QUERY_PROMPT_TEMPLATE = """
+Given the following question:
+
+"{user_message}"
+
+Context:
+ You are Enerzal, a friendly and intelligent chatbot developed by Tech Enerzal. Your primary role is to assist employees of Tech Enerzal by providing helpful, polite, and accurate information. You should always maintain a friendly and approachable tone while ensuring your responses are clear and informative. Your purpose is to assist with the following:
+
+1. **HR-Related Queries:** Help employees with questions regarding company policies, leave management, employee benefits, payroll, and other HR-related topics. Be empathetic and supportive, especially for sensitive topics like leave or benefits.
+
+2. **IT Support:** Provide guidance on common IT issues employees may encounter, such as troubleshooting technical problems, resetting passwords, or navigating company software. Be patient and provide step-by-step instructions for resolving technical issues.
+
+3. **Company Events & Updates:** Keep employees informed about upcoming company events, milestones, and internal updates. Share details about events in a friendly, enthusiastic tone to keep the company culture vibrant and engaging.
+
+4. **Uploaded Document Summarization and Querying:** Enerzal also helps employees by summarizing documents (PDF, DOCX, TXT) and answering queries based on the content of uploaded documents. For document summaries, be concise and informative, extracting the key points while maintaining clarity. When answering queries, provide clear and accurate answers based on the document content, making sure to offer further assistance if needed.
+
+Determine whether the assistant needs to access an external database for only  HR , IT , Company events to provide an accurate answer. For Uploaded Document's and casual talks Default to NO 
+
+Answer with 'Yes' if the database is required, or 'No' if the database is not required.
+
+Answer in the following format:
 
-# Initialize the ranker for re-ranking search results
-logging.debug("Initializing the ranker...")
-ranker = Ranker(model_name="rank-T5-flan", cache_dir="/Temp")
-logging.info("Ranker initialized.")
+"Database required: Yes" or "Database required: No"
+"""
+
+# Call the gemma2:2b model API for the self-query
+SELF_QUERY_MODEL_API_URL = 'http://localhost:11434/api/chat'  # Replace with your actual gemma2:2b API endpoint
+
+
+def _compose_self_query_body():
+    """
+    Serializes the self-query payload once and splits it around the user message.
+
+    Only the user message changes between requests, so each call just concatenates its JSON-escaped
+    text between the returned prefix and suffix instead of rebuilding and re-encoding the payload.
+
+    Returns:
+        tuple: The request body bytes before and after the user message.
+    """
+    placeholder = "__ENERZAL_USER_MESSAGE__"
+    self_query_model_payload = {
+        'model': 'gemma2:2b',  # Specify the model
+        'messages': [
+            {'role': 'system', 'content': 'You are an assistant that determines whether a database is required to answer a question.'},
+            {'role': 'user', 'content': SELF_QUERY_PROMPT_TEMPLATE.format(user_message=placeholder)}
+        ],
+        'options': {
+            'temperature': 0.0,
+            "num_predict": int(15),
+        },
+        'stream': False,  # Self-query does not need streaming
+        'keep_alive': 0
+    }
+    prefix, suffix = orjson.dumps(self_query_model_payload).split(placeholder.encode('utf-8'))
+    return prefix, suffix
+
+
+_SELF_QUERY_BODY_PREFIX, _SELF_QUERY_BODY_SUFFIX = _compose_self_query_body()
+
+# Example queries that do and do not need the database, used by the anchor classifier below
+DATABASE_ANCHOR_QUERIES = [
+    "what's my leave balance",
+    "how many casual leaves can I take in a year",
+    "what is the maternity leave policy",
+    "how do I apply for medical reimbursement",
+    "what allowances am I eligible for",
+    "what is the travel allowance policy",
+    "how does the performance review work",
+    "what is the notice period for resignation",
+    "what are the retirement benefits",
+    "how do I raise a grievance",
+    "what does the group insurance cover",
+    "am I eligible for company housing",
+    "what is the promotion policy",
+    "what is the code of conduct for employees",
+    "what training programs are available",
+    "when is salary credited",
+    "reset VPN password",
+    "my laptop is not connecting to the office wifi",
+    "company picnic date",
+    "what events are happening this month",
+]
+NO_DATABASE_ANCHOR_QUERIES = [
+    "summarize this document",
+    "what are the key points of the uploaded file",
+    "answer based on the attached pdf",
+    "hello",
+    "hi, how are you",
+    "thank you",
+    "who are you",
+    "tell me a joke",
+    "good morning",
+    "what can you do",
+]
+ANCHOR_MARGIN = 0.05  # Minimum similarity gap for the classifier to decide without the LLM
+
+# Normalized anchor embeddings, stacked so one matrix-vector product scores every anchor
+_anchor_matrix = np.asarray(
+    embedding_function.embed_documents(DATABASE_ANCHOR_QUERIES + NO_DATABASE_ANCHOR_QUERIES),
+    dtype=np.float32
+)
+_anchor_matrix /= np.linalg.norm(_anchor_matrix, axis=1, keepdims=True)
+
+
+def classify_database_required(query_vector):
+    """
+    Decides whether the database is required by comparing the query with the anchor queries.
+
+    Args:
+        query_vector (list): Embedding of the user message.
+
+    Returns:
+        bool or None: The decision, or None if the closest positive and negative anchors are too close to call.
+    """
+    query = np.asarray(query_vector, dtype=np.float32)
+    similarities = _anchor_matrix @ (query / np.linalg.norm(query))
+    n_positive = len(DATABASE_ANCHOR_QUERIES)
+    difference = similarities[:n_positive].max() - similarities[n_positive:].max()
+    logging.debug(f"Anchor classifier similarity difference: {difference:.3f}")
+    if abs(difference) < ANCHOR_MARGIN:
+        return None
+    return bool(difference > 0)
+
+
+def self_query_database_required(user_message):
+    """
+    Asks the gemma2:2b model whether the user message needs the external database to be answered.
+
+    Args:
+        user_message (str): The latest message from the user.
+
+    Returns:
+        bool or None: True if the database is required, False if it is not, or None if the reply
+        could not be parsed.
+
+    Raises:
+        ValueError: If the self-query model response has an unexpected format.
+    """
+    # Splice the JSON-escaped user message into the precomposed self-query request body
+    self_query_body = _SELF_QUERY_BODY_PREFIX + orjson.dumps(user_message)[1:-1] + _SELF_QUERY_BODY_SUFFIX
+    logging.debug("Self-query user message: %s", user_message)
+
+    # Make the API call to the self-query model
+    logging.info(f"Making self-query API call to {SELF_QUERY_MODEL_API_URL}")
+    self_query_response = _session.post(SELF_QUERY_MODEL_API_URL, data=self_query_body, headers=JSON_HEADERS)
+    self_query_response.raise_for_status()  # Raise an exception for HTTP errors
+    self_query_data = orjson.loads(self_query_response.content)
+    logging.debug(f"Self-query response data: {self_query_data}")
+
+    # Parse the response to determine if database access is required
+    if 'message' in self_query_data:
+        message = self_query_data['message']
+        if isinstance(message, dict):
+            assistant_reply = message.get('content', '').strip()
+        else:
+            logging.error(f"Invalid message format in response: {message}")
+            raise ValueError(f'Invalid message format in response: {message}')
+    elif 'messages' in self_query_data:
+        messages = self_query_data['messages']
+        if messages and isinstance(messages, list):
+            assistant_reply = messages[-1].get('content', '').strip()
+        else:
+            logging.error(f"Invalid messages format in response: {messages}")
+            raise ValueError(f'Invalid messages format in response: {messages}')
+    else:
+        logging.error(f"No message or messages key found in response: {self_query_data}")
+        raise ValueError(f'No message or messages key found in response: {self_query_data}')
+    logging.debug(f"Assistant reply from self-query: {assistant_reply}")
+
+    # Extract the database requirement from the assistant's reply using regex
+    match = DATABASE_REQUIRED_PATTERN.search(assistant_reply)
+    if match:
+        database_required = match.group(1).strip().lower() == 'yes'
+        logging.info(f"Database required: {database_required}")
+    else:
+        logging.warning(f"Could not parse database requirement from assistant reply: {assistant_reply}")
+        database_required = None  # The caller treats this as False without caching it
+
+    return database_required
+
+
+# Number of closest QA candidates passed to the reranker
+MAX_RERANK_CANDIDATES = 8
+
+# Number of FAQs kept after re-ranking
+TOP_FAQS = 3
+
+# Largest squared L2 distance of the best Full HR match for which the QA HR dataset is still searched.
+# The gate has not been calibrated on real user queries yet, so it is off unless FULL_HR_DISTANCE_GATE is set.
+# For reference, the stored QA HR entries (in-domain by construction) lie 0.45-1.44 from their nearest
+# Full HR section (median 0.85, 9% above 1.2); short user queries usually sit farther away than that.
+# Distances assume an exact flat or HNSW index: PQ error in an IVF+PQ store inflates them noticeably.
+FULL_HR_DISTANCE_GATE = float(os.environ.get("FULL_HR_DISTANCE_GATE", "inf"))
+
+# Worker threads for vector searches that run alongside the self-query call (FAISS releases the GIL)
+_retrieval_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-retrieval")
+
+
+def search_vector_stores(user_message):
+    """
+    Runs the full HR and QA HR vector searches for the user message.
+
+    The query is embedded once and the vector is reused for both searches. The QA search is not filtered
+    by section here, so it can start before the top sections are known.
+
+    Args:
+        user_message (str): The latest message from the user.
+
+    Returns:
+        tuple: The full HR documents and the QA HR documents, each ordered by similarity.
+    """
+    query_vector = embedding_function.embed_query(user_message)
+
+    # Step 3: Query the full HR dataset (Full_HR)
+    logging.info("Step 3: Querying the full HR dataset.")
+    k_full = 10  # Number of documents to retrieve
+    full_hr_results = get_faiss_full_hr().similarity_search_with_score_by_vector(query_vector, k=k_full)
+    full_hr_candidates = [doc for doc, _ in full_hr_results]
+    logging.debug(f"Retrieved {len(full_hr_candidates)} documents from full HR dataset.")
+
+    # Skip the QA search when even the closest section is a weak match
+    if not full_hr_results or full_hr_results[0][1] > FULL_HR_DISTANCE_GATE:
+        logging.info("Full HR matches are low-confidence. Skipping the QA HR search.")
+        return full_hr_candidates, []
+
+    # Step 4: Query the QA HR dataset; results are narrowed to the top sections by the caller
+    # One unfiltered query covers every section, so there are no per-section queries to batch
+    logging.info("Step 4: Querying the QA HR dataset.")
+    k_qa = 20
+    qa_results = get_faiss_qa_hr().similarity_search_by_vector(query_vector, k=k_qa)
+    logging.debug(f"Retrieved {len(qa_results)} FAQs from QA HR dataset.")
+
+    return full_hr_candidates, qa_results
 
 
 def generate_stream(payload):
@@ -130,86 +611,26 @@ def generate_stream(payload):
 
         # Step 2: Perform a self-query to determine if database access is required
         logging.info("Step 2: Performing self-query to determine if database is required.")
-        # Prepare the self-query prompt
-        self_query_prompt = f"""
-Given the following question:
-
-"{user_message}"
-
-Context:
- You are Enerzal, a friendly and intelligent chatbot developed by Tech Enerzal. Your primary role is to assist employees of Tech Enerzal by providing helpful, polite, and accurate information. You should always maintain a friendly and approachable tone while ensuring your responses are clear and informative. Your purpose is to assist with the following:
-
-1. **HR-Related Queries:** Help employees with questions regarding company policies, leave management, employee benefits, payroll, and other HR-related topics. Be empathetic and supportive, especially for sensitive topics like leave or benefits.
-
-2. **IT Support:** Provide guidance on common IT issues employees may encounter, such as troubleshooting technical problems, resetting passwords, or navigating company software. Be patient and provide step-by-step instructions for resolving technical issues.
-
-3. **Company Events & Updates:** Keep employees informed about upcoming company events, milestones, and internal updates. Share details about events in a friendly, enthusiastic tone to keep the company culture vibrant and engaging.
-
-4. **Uploaded Document Summarization and Querying:** Enerzal also helps employees by summarizing documents (PDF, DOCX, TXT) and answering queries based on the content of uploaded documents. For document summaries, be concise and informative, extracting the key points while maintaining clarity. When answering queries, provide clear and accurate answers based on the document content, making sure to offer further assistance if needed.
-
-Determine whether the assistant needs to access an external database for only  HR , IT , Company events to provide an accurate answer. For Uploaded Document's and casual talks Default to NO 
-
-Answer with 'Yes' if the database is required, or 'No' if the database is not required.
-
-Answer in the following format:
-
-"Database required: Yes" or "Database required: No"
-"""
-        logging.debug(f"Self-query prompt: {self_query_prompt}")
-
-        # Call the gemma2:2b model API for the self-query
-        # Prepare payload for the self-query
-        self_query_model_api_url = 'http://localhost:11434/api/chat'  # Replace with your actual gemma2:2b API endpoint
-        self_query_model_payload = {
-            'model': 'gemma2:2b',  # Specify the model
-            'messages': [
-                {'role': 'system', 'content': 'You are an assistant that determines whether a database is required to answer a question.'},
-                {'role': 'user', 'content': self_query_prompt}
-            ],
-            'options': {
-                'temperature': 0.0,
-                "num_predict": int(15),
-            },
-            'stream': False,  # Self-query does not need streaming
-            'keep_alive': 0
-        }
-        logging.debug(f"Self-query model payload: {self_query_model_payload}")
-
-        # Make the API call to the self-query model
-        logging.info(f"Making self-query API call to {self_query_model_api_url}")
-        self_query_response = requests.post(self_query_model_api_url, json=self_query_model_payload)
-        self_query_response.raise_for_status()  # Raise an exception for HTTP errors
-        self_query_data = self_query_response.json()
-        logging.debug(f"Self-query response data: {self_query_data}")
-
-        # Parse the response to determine if database access is required
-        if 'message' in self_query_data:
-            message = self_query_data['message']
-            if isinstance(message, dict):
-                assistant_reply = message.get('content', '').strip()
+        key = _query_key(user_message)
+        database_required = _selfquery_cache.get(key)
+        retrieval_future = None
+        if database_required is not None:
+            logging.info(f"Database required (cached): {database_required}")
+        else:
+            # Try the cheap anchor classifier first and only ask the LLM when it is not confident
+            database_required = classify_database_required(embedding_function.embed_query(user_message))
+            if database_required is not None:
+                logging.info(f"Database required (anchor classifier): {database_required}")
             else:
-                logging.error(f"Invalid message format in response: {message}")
-                raise ValueError(f'Invalid message format in response: {message}')
-        elif 'messages' in self_query_data:
-            messages = self_query_data['messages']
-            if messages and isinstance(messages, list):
-                assistant_reply = messages[-1].get('content', '').strip()
+                logging.info("Anchor classifier is not confident. Falling back to the self-query model.")
+                # Speculatively start the vector searches so they overlap with the self-query round trip
+                retrieval_future = _retrieval_executor.submit(search_vector_stores, user_message)
+                database_required = self_query_database_required(user_message)
+            if database_required is None:
+                # Default to False for this request only, so the next request asks the model again
+                database_required = False
             else:
-                logging.error(f"Invalid messages format in response: {messages}")
-                raise ValueError(f'Invalid messages format in response: {messages}')
-        else:
-            logging.error(f"No message or messages key found in response: {self_query_data}")
-            raise ValueError(f'No message or messages key found in response: {self_query_data}')
-        logging.debug(f"Assistant reply from self-query: {assistant_reply}")
-
-        # Extract the database requirement from the assistant's reply using regex
-        match = re.search(r'Database required:\s*(Yes|No)', assistant_reply, re.IGNORECASE)
-        if match:
-            database_required = match.group(1).strip().lower() == 'yes'
-            logging.info(f"Database required: {database_required}")
-        else:
-            logging.warning(f"Could not parse database requirement from assistant reply: {assistant_reply}")
-            database_required = False  # Default to False if parsing fails
+                _selfquery_cache.set(key, database_required)
 
         # Conditional logic based on whether the database is required
         # For now, keep the category and type determination commented out
@@ -227,32 +648,31 @@ Answer in the following format:
             logging.info("Database is required. Proceeding to search vector DB and generate response with context.")
              # Proceed to search vector DB and generate response with context
 
-            # Step 3: Query the full HR dataset (faiss_Full_HR)
-            logging.info("Step 3: Querying the full HR dataset.")
-            k_full = 10  # Number of documents to retrieve
-            full_hr_candidates = faiss_Full_HR.similarity_search(user_message, k=k_full)
-            logging.debug(f"Retrieved {len(full_hr_candidates)} documents from full HR dataset.")
+            # Steps 3 and 4: Use the speculative search results, or search now if the decision was cached
+            if retrieval_future is not None:
+                full_hr_candidates, qa_results = retrieval_future.result()
+            else:
+                full_hr_candidates, qa_results = search_vector_stores(user_message)
 
-            # Step 4: Query the QA of the top 2 selected Sections from Full HR
-            logging.info("Step 4: Querying the QA of the top 2 selected sections from Full HR.")
+            # Keep only the FAQs that belong to the top 2 selected sections from Full HR
             top_sections = full_hr_candidates[:2]
             section_names = [doc.metadata.get('section_name') for doc in top_sections]
             logging.debug(f"Top section names: {section_names}")
-
-            # Retrieve related FAQs from faiss_QA_HR based on the top sections
-            qa_candidates = []
-            for section_name in section_names:
-                logging.debug(f"Querying FAQs for section: {section_name}")
-                # Use the 'filter' parameter in FAISS similarity_search to narrow down the search
-                k_qa = 10
-                qa_results = faiss_QA_HR.similarity_search(
-                    user_message,
-                    k=k_qa,
-                    filter={'section_name': section_name}
-                )
-                qa_candidates.extend(qa_results)
-                logging.debug(f"Retrieved {len(qa_results)} FAQs for section {section_name}")
-                logging.debug(f"Retrieved {qa_results} FAQs for section {section_name}")
+            qa_candidates = [doc for doc in qa_results if doc.metadata.get('section_name') in section_names]
+            logging.debug(f"Retrieved {len(qa_candidates)} FAQs for sections {section_names}")
+
+            # Drop duplicate FAQs so the reranker does not score the same passage twice
+            # (FAQs without an id fall back to their text as the key)
+            seen_faqs = set()
+            unique_candidates = []
+            for doc in qa_candidates:
+                faq_key = doc.metadata.get('ids') or doc.page_content
+                if faq_key in seen_faqs:
+                    continue
+                seen_faqs.add(faq_key)
+                unique_candidates.append(doc)
+            # Candidates keep the FAISS similarity order, so the closest ones are re-ranked and the rest dropped
+            qa_candidates = unique_candidates[:MAX_RERANK_CANDIDATES]
 
             # Step 5: Re-rank the QA passages to select the most relevant FAQs
             logging.info("Step 5: Re-ranking the QA passages.")
@@ -264,38 +684,55 @@ Answer in the following format:
             } for doc in qa_candidates]
             logging.debug(f"Total QA passages for re-ranking: {len(qa_passages)}")
 
-            rerank_request = RerankRequest(query=user_message, passages=qa_passages)
-            reranked_qa_results = ranker.rerank(rerank_request)
-            logging.debug("Reranked QA results obtained.")
+            # Re-ranking only pays off when there are more passages than FAQs to keep
+            if len(qa_passages) > TOP_FAQS:
+                rerank_request = RerankRequest(query=user_message, passages=qa_passages)
+                reranked_qa_results = get_ranker().rerank(rerank_request)
+                logging.debug("Reranked QA results obtained.")
+            else:
+                reranked_qa_results = qa_passages
+                logging.debug("Skipped re-ranking for a small number of QA passages.")
 
             # Select top FAQs after re-ranking
-            top_faqs = reranked_qa_results[:3]
+            top_faqs = reranked_qa_results[:TOP_FAQS]
             logging.info(f"Selected top {len(top_faqs)} FAQs.")
 
             # Step 6: Combine the retrieved sections and FAQs to prepare the context
             logging.info("Step 6: Preparing context and modifying messages.")
+            # Write the context into a single buffer instead of joining intermediate lists
+            context_buffer = io.StringIO()
             # Prepare context from the top sections
-            context_sections = '\n\n'.join([doc.page_content for doc in top_sections])
-            # Prepare context from the top FAQs
-            context_faqs = '\n\n'.join([faq['text'] for faq in top_faqs])
+            context_buffer.write("Sections:\n")
+            for i, doc in enumerate(top_sections):
+                if i:
+                    context_buffer.write("\n\n")
+                context_buffer.write(doc.page_content)
+            context_buffer.write("\n")
 
             # Currently, only sections are included in the context
-            # context = f"Sections:\n{context_sections}\n\nFAQs:\n{context_faqs}"
+            # Prepare context from the top FAQs
+            # context_buffer.write("\nFAQs:\n")
+            # for i, faq in enumerate(top_faqs):
+            #     if i:
+            #         context_buffer.write("\n\n")
+            #     context_buffer.write(faq['text'])
 
-            context = f"Sections:\n{context_sections}\n"
+            context = context_buffer.getvalue()
 
             logging.debug("Context prepared.")
 
-            # Insert system message with context before the last user message
-            messages.insert(-1, {
+            # Build a new list with the system message placed before the last user message,
+            # leaving the caller's payload untouched so retries do not insert the context twice
+            messages = [*messages[:-1], {
                 'role': 'system',
                 'content': f'Using the provided context from the database for Tech Enerzal to answer the user query.\nContext="{context}"'
-            })
+            }, messages[-1]]
             logging.debug("Inserted system message with context into messages.")
 
         else:
             logging.info("Database is not required. Proceeding without context.")
             # No need to modify messages if database access is not required
+            # Any speculative search is simply discarded once it finishes
 
         # Step 7: Call the model via API to generate the final response
         logging.info("Step 7: Calling the model via API.")
@@ -323,36 +760,56 @@ Answer in the following format:
                 str: JSON-formatted response chunks or error messages.
             """
             logging.debug(f"Making model API call to {model_api_url}")
-            with requests.post(model_api_url, json=model_payload, stream=True) as response:
+            with _session.post(model_api_url, data=orjson.dumps(model_payload), headers=JSON_HEADERS, stream=True) as response:
                 response.raise_for_status()  # Raise an exception for HTTP errors
                 logging.info("Model API call successful. Streaming response...")
-                for line in response.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8')
-                        # Assuming the API returns JSON lines with 'message' containing 'role' and 'content'
-                        try:
-                            data = json.loads(decoded_line)
-                            logging.debug(f"Received JSON data: {data}")
-                    
-                            # Accessing nested 'message' object
-                            message = data.get('message', {})
-                            role = message.get('role')
-                            content = message.get('content', '')
-
-                            # Only yield user and assistant messages
-                            if role in ['assistant', 'user']:
-                                yield content + '\n'
-                                logging.debug(f"Yielded content chunk: {content}")
-                            else:
-                                logging.debug(f"Ignored message with role: {role}")
-                        
-                        except json.JSONDecodeError:
-                            # If the line is not valid JSON, log it and yield the raw line
-                            logging.warning(f"Received non-JSON line: {decoded_line}")
-                            yield decoded_line + '\n'
-
-                        # Log the raw line received for additional visibility
-                        logging.debug(f"Raw line received: {decoded_line}")
+                # Split newline-delimited JSON ourselves so each line is handled as soon as its bytes arrive
+                buffer = bytearray()
+                for chunk in response.iter_content(chunk_size=None):
+                    buffer += chunk
+                    while (newline_index := buffer.find(b'\n')) != -1:
+                        line = bytes(buffer[:newline_index])
+                        del buffer[:newline_index + 1]
+                        yield from parse_model_line(line)
+                # Handle a final line that was not terminated by a newline
+                if buffer:
+                    yield from parse_model_line(bytes(buffer))
+
+        def parse_model_line(line):
+            """
+            Parses one JSON line from the model API and yields its content.
+
+            Args:
+                line (bytes): A single newline-delimited JSON line.
+
+            Yields:
+                str: The message content, or the raw line if it is not valid JSON.
+            """
+            line = line.strip()
+            if not line:
+                return
+            # Assuming the API returns JSON lines with 'message' containing 'role' and 'content'
+            try:
+                data = orjson.loads(line)
+                logging.debug(f"Received JSON data: {data}")
+
+                # Accessing nested 'message' object
+                message = data.get('message', {})
+                role = message.get('role')
+                content = message.get('content', '')
+
+                # Only yield user and assistant messages
+                if role in ['assistant', 'user']:
+                    yield content + '\n'
+                    logging.debug(f"Yielded content chunk: {content}")
+                else:
+                    logging.debug(f"Ignored message with role: {role}")
+
+            except orjson.JSONDecodeError:
+                # If the line is not valid JSON, log it and yield the raw line
+                decoded_line = line.decode('utf-8', errors='replace')
+                logging.warning(f"Received non-JSON line: {decoded_line}")
+                yield decoded_line + '\n'
 
         # Yield the response chunks to the caller
         for chunk in stream_model_response():
@@ -360,5 +817,5 @@ Answer in the following format:
 
     except Exception as e:
         logging.exception("Error in generate_stream")
-        yield json.dumps({"error": f"Error in generating response: {str(e)}"})
+        yield orjson.dumps({"error": f"Error in generating response: {str(e)}"}).decode()
 